@@ -0,0 +1,74 @@
+"""Unit tests for the github-issue setup's password hashing and retry policy.
+
+Run from this directory with: python -m unittest test_github_issue_setup
+"""
+
+import base64
+import hashlib
+import importlib.util
+import json
+import os
+import unittest
+from types import SimpleNamespace
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError
+
+_spec = importlib.util.spec_from_file_location(
+    "github_issue_setup",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "setup_keycloak.py"),
+)
+setup = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(setup)
+
+
+class HashedPasswordCredentialTest(unittest.TestCase):
+    def setUp(self):
+        self.credential = setup.hashed_password_credential("alice123")
+        self.credential_data = json.loads(self.credential["credentialData"])
+        self.secret_data = json.loads(self.credential["secretData"])
+
+    def test_matches_keycloak_pbkdf2_sha256(self):
+        self.assertEqual(self.credential["type"], "password")
+        self.assertFalse(self.credential["temporary"])
+        self.assertEqual(self.credential_data["algorithm"], "pbkdf2-sha256")
+        self.assertEqual(self.credential_data["hashIterations"], 27500)
+
+    def test_salt_and_hash_lengths(self):
+        self.assertEqual(len(base64.b64decode(self.secret_data["salt"])), 16)
+        self.assertEqual(len(base64.b64decode(self.secret_data["value"])), 64)
+
+    def test_hash_verifies_the_password(self):
+        salt = base64.b64decode(self.secret_data["salt"])
+        expected = hashlib.pbkdf2_hmac(
+            "sha256", b"alice123", salt, self.credential_data["hashIterations"], dklen=64
+        )
+        self.assertEqual(base64.b64decode(self.secret_data["value"]), expected)
+
+    def test_salt_is_random(self):
+        other = json.loads(setup.hashed_password_credential("alice123")["secretData"])
+        self.assertNotEqual(other["salt"], self.secret_data["salt"])
+
+
+class AdminRetryTest(unittest.TestCase):
+    def setUp(self):
+        session = requests.Session()
+        setup.configure_session(SimpleNamespace(connection=SimpleNamespace(_s=session)))
+        self.retry = session.get_adapter("http://keycloak:8080/").max_retries
+
+    def test_post_is_not_retried_on_error_statuses(self):
+        for status in (429, 502, 503, 504):
+            self.assertFalse(self.retry.is_retry("POST", status))
+
+    def test_other_methods_are_retried_on_error_statuses(self):
+        for method in ("GET", "PUT", "DELETE"):
+            self.assertTrue(self.retry.is_retry(method, 503))
+
+    def test_post_is_retried_on_connection_errors(self):
+        retry = self.retry.increment(method="POST", error=ConnectTimeoutError())
+        self.assertIsInstance(retry, setup.AdminRetry)
+        self.assertEqual(retry.total, self.retry.total - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
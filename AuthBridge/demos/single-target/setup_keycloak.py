@@ -38,9 +38,21 @@ auto-registered credentials) to exchange tokens.
 IMPORTANT: The SPIFFE ID is hardcoded for the demo:
   spiffe://localtest.me/ns/authbridge/sa/agent
 If your namespace or service account differs, update AGENT_SPIFFE_ID below.
+
+Completed steps are recorded in ~/.cache/authbridge-setup.json (override with
+AUTHBRIDGE_SETUP_STATE) and skipped on re-runs. Steps are keyed by the realm's
+internal ID, so a recreated realm is set up again; delete the file to force a
+full run.
 """
 
-from keycloak import KeycloakAdmin, KeycloakPostError
+from keycloak import KeycloakAdmin, KeycloakGetError, KeycloakPostError
+import asyncio
+import hashlib
+import httpx
+import io
+import json
+import os
+import random
 import sys
 
 KEYCLOAK_URL = "http://keycloak.localtest.me:8080"
@@ -52,6 +64,65 @@ KEYCLOAK_ADMIN_PASSWORD = "admin"
 # Update this if your deployment uses different namespace/serviceAccount
 AGENT_SPIFFE_ID = "spiffe://localtest.me/ns/authbridge/sa/agent"
 
+STATE_FILE = os.path.expanduser(
+    os.environ.get("AUTHBRIDGE_SETUP_STATE", "~/.cache/authbridge-setup.json")
+)
+
+# Transient gateway errors from a Keycloak pod that is still starting
+RETRY_STATUSES = frozenset({502, 503, 504})
+RETRY_ATTEMPTS = 5
+# Methods that are safe to resend after the server may already have acted on them
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+# Timeout (seconds) for the initial reachability check
+PREFLIGHT_TIMEOUT = 2
+
+# auth-target client (required as token exchange audience target)
+AUTH_TARGET_CLIENT = {
+    "clientId": "auth-target",
+    "name": "Auth Target",
+    "enabled": True,
+    "publicClient": False,
+    "standardFlowEnabled": False,
+    "serviceAccountsEnabled": True,
+    "attributes": {
+        "standard.token.exchange.enabled": "true"
+    }
+}
+
+# agent-spiffe-aud scope - adds Agent's SPIFFE ID to token audience (realm default)
+# This allows the auto-registered Agent client to exchange tokens
+AGENT_SPIFFE_SCOPE = {
+    "name": "agent-spiffe-aud",
+    "protocol": "openid-connect",
+    "attributes": {
+        "include.in.token.scope": "true",
+        "display.on.consent.screen": "true"
+    }
+}
+
+# auth-target-aud scope - added to exchanged tokens
+# This makes the AuthProxy's exchanged token valid for auth-target
+AUTH_TARGET_SCOPE = {
+    "name": "auth-target-aud",
+    "protocol": "openid-connect",
+    "attributes": {
+        "include.in.token.scope": "true",
+        "display.on.consent.screen": "true"
+    }
+}
+
+# Audience mapper template; name and included.custom.audience are filled per scope
+AUDIENCE_MAPPER = {
+    "protocol": "openid-connect",
+    "protocolMapper": "oidc-audience-mapper",
+    "consentRequired": False,
+    "config": {
+        "id.token.claim": "false",
+        "access.token.claim": "true",
+        "userinfo.token.claim": "false"
+    }
+}
+
 # Demo user for demonstrating subject preservation
 DEMO_USER = {
     "username": "alice",
@@ -61,92 +132,326 @@ DEMO_USER = {
     "password": "alice123"
 }
 
+# Printed once setup finishes; {agent_spiffe_id}, {username} and {password}
+# are filled in from AGENT_SPIFFE_ID and DEMO_USER
+NEXT_STEPS_TEMPLATE = r"""
+============================================================
+SETUP COMPLETE
+============================================================
+
+============================================================
+NEXT STEPS
+============================================================
+
+1. Deploy the AuthBridge demo:
+
+   # With SPIFFE (requires SPIRE)
+   kubectl apply -f demos/single-target/k8s/authbridge-deployment.yaml
+
+   # OR without SPIFFE
+   kubectl apply -f demos/single-target/k8s/authbridge-deployment-no-spiffe.yaml
+
+2. Wait for pods to be ready:
+
+   kubectl wait --for=condition=available --timeout=120s deployment/agent -n authbridge
+   kubectl wait --for=condition=available --timeout=120s deployment/auth-target -n authbridge
+
+3. Test from inside the agent pod:
+
+   kubectl exec -it deployment/agent -n authbridge -c agent -- sh
+   
+   # Inside the container (credentials are auto-populated by client-registration):
+   CLIENT_ID=$(cat /shared/client-id.txt)
+   CLIENT_SECRET=$(cat /shared/client-secret.txt)
+   
+   # Get a token (simulating what a Caller would do)
+   # The token will have aud: {agent_spiffe_id}
+   TOKEN=$(curl -sX POST \
+     http://keycloak-service.keycloak.svc:8080/realms/demo/protocol/openid-connect/token \
+     -d 'grant_type=client_credentials' \
+     -d "client_id=$CLIENT_ID" \
+     -d "client_secret=$CLIENT_SECRET" | jq -r '.access_token')
+   
+   # Verify token audience (should be the Agent's SPIFFE ID)
+   echo $TOKEN | cut -d'.' -f2 | tr '_-' '/+' | {{ read p; echo "${{p}}=="; }} | base64 -d | jq '{{aud, azp, scope}}'
+   
+   # Agent calls auth-target (AuthProxy will exchange token for aud: auth-target)
+   curl -H "Authorization: Bearer $TOKEN" http://auth-target-service:8081/test
+   # Expected: "authorized"
+
+4. Test with a USER TOKEN (demonstrates subject preservation):
+
+   # Get a token for demo user 'alice' using password grant
+   # This demonstrates how the user's identity (sub claim) is preserved during exchange
+   
+   USER_TOKEN=$(curl -sX POST \
+     http://keycloak-service.keycloak.svc:8080/realms/demo/protocol/openid-connect/token \
+     -d 'grant_type=password' \
+     -d "client_id=$CLIENT_ID" \
+     -d "client_secret=$CLIENT_SECRET" \
+     -d 'username={username}' \
+     -d 'password={password}' | jq -r '.access_token')
+   
+   # Check the ORIGINAL token - note the 'sub' claim contains alice's user ID
+   # and 'preferred_username' shows 'alice'
+   echo "=== ORIGINAL TOKEN (user: alice) ==="
+   echo $USER_TOKEN | cut -d'.' -f2 | tr '_-' '/+' | {{ read p; echo "${{p}}=="; }} | base64 -d | jq '{{sub, preferred_username, aud, azp}}'
+   
+   # Call auth-target - token exchange preserves the subject!
+   curl -H "Authorization: Bearer $USER_TOKEN" http://auth-target-service:8081/test
+   # Expected: "authorized"
+   
+   # Check auth-target logs to see alice's subject in the exchanged token:
+   kubectl logs deployment/auth-target -n authbridge | grep -A5 "JWT Debug" | tail -10
+
+
+------------------------------------------------------------
+HOW IT WORKS
+------------------------------------------------------------
+
+1. Agent pod starts and registers with Keycloak using its SPIFFE ID:
+   client_id = {agent_spiffe_id}
+
+2. Credentials are saved to /shared/client-id.txt and /shared/client-secret.txt
+
+3. When a Caller gets a token, it has:
+   aud: {agent_spiffe_id}  (via agent-spiffe-aud realm default scope)
+
+4. AuthProxy intercepts outgoing requests and exchanges the token using
+   the same credentials from /shared/ (matching the token's audience)
+
+5. The exchanged token has aud: auth-target
 
-def get_or_create_realm(keycloak_admin, realm_name):
-    """Create realm if it doesn't exist."""
+No pre-configured 'agent' client needed - the agent registers itself
+dynamically and AuthProxy uses the resulting client credentials!
+"""
+
+# Output is collected here and written to stdout in one go at the end of each
+# phase, before it waits on Keycloak, so progress stays visible
+_out = io.StringIO()
+
+
+def log(message=""):
+    """Append a line to the output buffer."""
+    _out.write(message + "\n")
+
+
+def flush_log():
+    """Write buffered output to stdout with a single write."""
+    sys.stdout.write(_out.getvalue())
+    sys.stdout.flush()
+    _out.seek(0)
+    _out.truncate()
+
+
+def load_state():
+    """Load the completed-step log, or start an empty one."""
     try:
-        realms = keycloak_admin.get_realms()
-        for realm in realms:
-            if realm['realm'] == realm_name:
-                print(f"Realm '{realm_name}' already exists.")
-                return
-        keycloak_admin.create_realm({
-            "realm": realm_name,
-            "enabled": True,
-            "displayName": realm_name,
-        })
-        print(f"Created realm '{realm_name}'.")
-    except Exception as e:
-        print(f"Error checking/creating realm: {e}")
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    """Write the completed-step log atomically."""
+    state_dir = os.path.dirname(STATE_FILE)
+    if state_dir:
+        os.makedirs(state_dir, exist_ok=True)
+    tmp_file = f"{STATE_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, STATE_FILE)
+
+
+def step_key(realm_id, op_name, payload):
+    """Deterministic key for one setup step against one realm instance."""
+    material = json.dumps([KEYCLOAK_URL, realm_id, op_name, payload], sort_keys=True)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+async def run_step(state, realm_id, description, payload, func, *args):
+    """Await func(*args) unless this step already completed; return its result.
+
+    Only truthy results are recorded, so failed steps are retried next run.
+    """
+    key = step_key(realm_id, func.__name__, payload)
+    if key in state:
+        log(f"Skipping {description} (already done)")
+        return state[key]
+    result = await func(*args)
+    if result:
+        state[key] = result
+        save_state(state)
+    return result
+
+
+class RetryTransport(httpx.AsyncHTTPTransport):
+    """Pooled async transport that retries transient gateway errors.
 
+    A Keycloak pod that is still starting answers 502/503 or refuses connections.
+    Failed connects are retried for every method, since the request never left;
+    502/503/504 answers are retried only for idempotent methods, so a POST that
+    may already have created something is never resent. Up to 5 attempts with
+    jittered exponential backoff (1s, 2s, 4s, 8s, capped at 16s).
+    """
 
-def get_or_create_client(keycloak_admin, client_payload):
-    """Create client if doesn't exist, return internal client ID."""
+    async def handle_async_request(self, request):
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            try:
+                response = await super().handle_async_request(request)
+                if (response.status_code not in RETRY_STATUSES
+                        or request.method not in IDEMPOTENT_METHODS
+                        or attempt == RETRY_ATTEMPTS):
+                    return response
+                await response.aclose()
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt == RETRY_ATTEMPTS:
+                    raise
+            await asyncio.sleep(min(2 ** (attempt - 1), 16) + random.uniform(0, 1))
+
+
+def admin_http_client():
+    """Async HTTP client with a keep-alive pool for the admin connection."""
+    limits = httpx.Limits(max_connections=20, max_keepalive_connections=20)
+    return httpx.AsyncClient(transport=RetryTransport(limits=limits))
+
+
+async def get_or_create_realm(keycloak_admin, realm_name):
+    """Create realm if it doesn't exist, return its internal ID."""
+    try:
+        realm = await keycloak_admin.a_get_realm(realm_name)
+        log(f"Realm '{realm_name}' already exists.")
+        return realm["id"]
+    except KeycloakGetError as e:
+        if e.response_code != 404:
+            log(f"Error checking realm: {e}")
+            raise
+    await keycloak_admin.a_create_realm({
+        "realm": realm_name,
+        "enabled": True,
+        "displayName": realm_name,
+    })
+    log(f"Created realm '{realm_name}'.")
+    return (await keycloak_admin.a_get_realm(realm_name))["id"]
+
+
+def lazy_index(fetch, key):
+    """Return a coroutine function that lists objects on first use only.
+
+    The listing is fetched once and mapped from item[key] to item ID; concurrent
+    callers share the same request. Fully recorded re-runs never fetch it.
+    """
+    task = None
+
+    async def build():
+        return {item[key]: item["id"] for item in await fetch()}
+
+    async def index():
+        nonlocal task
+        if task is None:
+            task = asyncio.ensure_future(build())
+        return await task
+
+    return index
+
+
+async def get_or_create_client(keycloak_admin, client_payload, clients_index):
+    """Create client if doesn't exist, return internal client ID.
+
+    clients_index() maps clientId to internal ID; the mapping is updated on create.
+    """
     client_id = client_payload['clientId']
-    existing_client_id = keycloak_admin.get_client_id(client_id)
+    clients_by_id = await clients_index()
+    existing_client_id = clients_by_id.get(client_id)
     if existing_client_id:
-        print(f"Client '{client_id}' already exists.")
+        log(f"Client '{client_id}' already exists.")
         return existing_client_id
-    internal_id = keycloak_admin.create_client(client_payload)
-    print(f"Created client '{client_id}'.")
+    internal_id = await keycloak_admin.a_create_client(client_payload)
+    clients_by_id[client_id] = internal_id
+    log(f"Created client '{client_id}'.")
     return internal_id
 
 
-def get_or_create_client_scope(keycloak_admin, scope_payload):
-    """Create client scope if doesn't exist, return scope ID."""
+async def get_or_create_client_scope(keycloak_admin, scope_payload, scopes_index):
+    """Create client scope if doesn't exist, return scope ID.
+
+    scopes_index() maps scope name to ID; the mapping is updated on create.
+    """
     scope_name = scope_payload.get("name")
-    scopes = keycloak_admin.get_client_scopes()
-    for scope in scopes:
-        if scope['name'] == scope_name:
-            print(f"Client scope '{scope_name}' already exists with ID: {scope['id']}")
-            return scope['id']
+    scopes_by_name = await scopes_index()
+    if scope_name in scopes_by_name:
+        log(f"Client scope '{scope_name}' already exists with ID: {scopes_by_name[scope_name]}")
+        return scopes_by_name[scope_name]
 
     try:
-        scope_id = keycloak_admin.create_client_scope(scope_payload)
-        print(f"Created client scope '{scope_name}': {scope_id}")
+        scope_id = await keycloak_admin.a_create_client_scope(scope_payload)
+        scopes_by_name[scope_name] = scope_id
+        log(f"Created client scope '{scope_name}': {scope_id}")
         return scope_id
     except KeycloakPostError as e:
-        print(f"Could not create client scope '{scope_name}': {e}")
+        log(f"Could not create client scope '{scope_name}': {e}")
         raise
 
 
-def add_audience_mapper(keycloak_admin, scope_id, mapper_name, audience):
+async def add_audience_mapper(keycloak_admin, scope_id, mapper_name, audience):
     """Add audience protocol mapper to a client scope."""
     mapper_payload = {
+        **AUDIENCE_MAPPER,
         "name": mapper_name,
-        "protocol": "openid-connect",
-        "protocolMapper": "oidc-audience-mapper",
-        "consentRequired": False,
-        "config": {
-            "included.custom.audience": audience,
-            "id.token.claim": "false",
-            "access.token.claim": "true",
-            "userinfo.token.claim": "false"
-        }
+        "config": {**AUDIENCE_MAPPER["config"], "included.custom.audience": audience},
     }
     
     try:
-        keycloak_admin.add_mapper_to_client_scope(scope_id, mapper_payload)
-        print(f"Added audience mapper '{mapper_name}' for audience '{audience}'")
+        await keycloak_admin.a_add_mapper_to_client_scope(scope_id, mapper_payload)
+        log(f"Added audience mapper '{mapper_name}' for audience '{audience}'")
+        return True
     except Exception as e:
-        # Mapper might already exist
-        print(f"Note: Could not add mapper '{mapper_name}' (might already exist): {e}")
+        if getattr(e, "response_code", None) == 409:
+            log(f"Audience mapper '{mapper_name}' already exists.")
+            return True
+        log(f"Note: Could not add mapper '{mapper_name}': {e}")
+        return False
 
 
-def get_or_create_user(keycloak_admin, user_config):
+async def setup_scope(state, realm_id, keycloak_admin, scopes_index, scope_payload, audience):
+    """Create one client scope with its audience mapper; return its ID."""
+    scope_name = scope_payload["name"]
+    scope_id = await run_step(
+        state, realm_id, f"client scope '{scope_name}'", scope_payload,
+        get_or_create_client_scope, keycloak_admin, scope_payload, scopes_index,
+    )
+    await run_step(
+        state, realm_id, f"audience mapper '{scope_name}'",
+        {"scope_id": scope_id, "audience": audience},
+        add_audience_mapper, keycloak_admin, scope_id, scope_name, audience,
+    )
+    return scope_id
+
+
+async def assign_scope(add_scope, scope_id, added_message, failed_message):
+    """Run one scope assignment call; return whether it succeeded and what to print."""
+    try:
+        await add_scope(scope_id)
+        return True, added_message
+    except Exception as e:
+        return False, f"{failed_message}: {e}"
+
+
+async def get_or_create_user(keycloak_admin, user_config):
     """Create a demo user if it doesn't exist."""
     username = user_config["username"]
     
     # Check if user exists (get_users may be fuzzy, so filter for exact username)
-    users = keycloak_admin.get_users({"username": username})
+    users = await keycloak_admin.a_get_users({"username": username})
     exact_users = [u for u in users if u.get("username") == username]
     if exact_users:
-        print(f"User '{username}' already exists.")
+        log(f"User '{username}' already exists.")
         return exact_users[0]["id"]
     
     # Create user
     try:
-        user_id = keycloak_admin.create_user({
+        user_id = await keycloak_admin.a_create_user({
             "username": username,
             "email": user_config["email"],
             "firstName": user_config["firstName"],
@@ -159,209 +464,154 @@ def get_or_create_user(keycloak_admin, user_config):
                 "temporary": False
             }]
         })
-        print(f"Created user '{username}' with ID: {user_id}")
+        log(f"Created user '{username}' with ID: {user_id}")
         return user_id
     except KeycloakPostError as e:
-        print(f"Could not create user '{username}': {e}")
+        log(f"Could not create user '{username}': {e}")
         raise
 
 
-def main():
-    print("=" * 60)
-    print("AuthBridge Demo - Keycloak Setup")
-    print("=" * 60)
-    print(f"\nAgent SPIFFE ID: {AGENT_SPIFFE_ID}")
+async def configure_keycloak(http_client):
+    log("=" * 60)
+    log("AuthBridge Demo - Keycloak Setup")
+    log("=" * 60)
+    log(f"\nAgent SPIFFE ID: {AGENT_SPIFFE_ID}")
     
-    # Connect to Keycloak master realm first
-    print(f"\nConnecting to Keycloak at {KEYCLOAK_URL}...")
+    # Connect to Keycloak master realm first. A single admin client (and so a
+    # single admin token) is used throughout; it switches realms below.
+    log(f"\nConnecting to Keycloak at {KEYCLOAK_URL}...")
+    flush_log()
     try:
-        master_admin = KeycloakAdmin(
+        # Cheap reachability check so a missing port-forward fails fast instead
+        # of inside the admin token request. It bypasses the retrying transport
+        # so an unreachable server is reported within PREFLIGHT_TIMEOUT.
+        async with httpx.AsyncClient(timeout=PREFLIGHT_TIMEOUT) as preflight_client:
+            await preflight_client.head(
+                f"{KEYCLOAK_URL}/realms/master", follow_redirects=True
+            )
+        keycloak_admin = KeycloakAdmin(
             server_url=KEYCLOAK_URL,
             username=KEYCLOAK_ADMIN_USERNAME,
             password=KEYCLOAK_ADMIN_PASSWORD,
             realm_name="master",
             user_realm_name="master"
         )
+        # Replace the library's own (still unused) async clients with the shared
+        # one: the admin calls use the admin connection's client, while the
+        # admin token is requested through the KeycloakOpenID connection's.
+        for connection in (keycloak_admin.connection,
+                           keycloak_admin.connection.keycloak_openid.connection):
+            await connection.async_s.aclose()
+            connection.async_s = http_client
     except Exception as e:
-        print(f"Failed to connect to Keycloak: {e}")
-        print("\nMake sure Keycloak is running and accessible at:")
-        print(f"  {KEYCLOAK_URL}")
-        print("\nIf using port-forward, run:")
-        print("  kubectl port-forward service/keycloak-service -n keycloak 8080:8080")
+        log(f"Failed to connect to Keycloak: {e}")
+        log("\nMake sure Keycloak is running and accessible at:")
+        log(f"  {KEYCLOAK_URL}")
+        log("\nIf using port-forward, run:")
+        log("  kubectl port-forward service/keycloak-service -n keycloak 8080:8080")
         sys.exit(1)
     
     # Create demo realm if needed
-    print(f"\n--- Setting up realm: {KEYCLOAK_REALM} ---")
-    get_or_create_realm(master_admin, KEYCLOAK_REALM)
-    
-    # Switch to demo realm
-    keycloak_admin = KeycloakAdmin(
-        server_url=KEYCLOAK_URL,
-        username=KEYCLOAK_ADMIN_USERNAME,
-        password=KEYCLOAK_ADMIN_PASSWORD,
-        realm_name=KEYCLOAK_REALM,
-        user_realm_name="master"
-    )
+    log(f"\n--- Setting up realm: {KEYCLOAK_REALM} ---")
+    flush_log()
+    realm_id = await get_or_create_realm(keycloak_admin, KEYCLOAK_REALM)
+    state = load_state()
     
-    # Create auth-target client (required as token exchange audience target)
-    print("\n--- Creating auth-target client ---")
-    print("This client is required as the target audience for token exchange")
-    auth_target_id = get_or_create_client(keycloak_admin, {
-        "clientId": "auth-target",
-        "name": "Auth Target",
-        "enabled": True,
-        "publicClient": False,
-        "standardFlowEnabled": False,
-        "serviceAccountsEnabled": True,
-        "attributes": {
-            "standard.token.exchange.enabled": "true"
-        }
-    })
-    
-    # Create client scopes
-    print("\n--- Creating client scopes ---")
-    
-    # agent-spiffe-aud scope - adds Agent's SPIFFE ID to token audience (realm default)
-    # This allows the auto-registered Agent client to exchange tokens
-    print(f"\nCreating scope for Agent's SPIFFE ID audience...")
-    agent_spiffe_scope_id = get_or_create_client_scope(keycloak_admin, {
-        "name": "agent-spiffe-aud",
-        "protocol": "openid-connect",
-        "attributes": {
-            "include.in.token.scope": "true",
-            "display.on.consent.screen": "true"
-        }
-    })
-    add_audience_mapper(keycloak_admin, agent_spiffe_scope_id, "agent-spiffe-aud", AGENT_SPIFFE_ID)
+    # Switch to demo realm; the master-realm admin token stays valid
+    keycloak_admin.change_current_realm(KEYCLOAK_REALM)
+
+    # Existing clients and scopes are listed once, and only if a step needs them
+    clients_index = lazy_index(keycloak_admin.a_get_clients, "clientId")
+    scopes_index = lazy_index(keycloak_admin.a_get_client_scopes, "name")
     
-    # auth-target-aud scope - added to exchanged tokens
-    # This makes the AuthProxy's exchanged token valid for auth-target
-    auth_target_scope_id = get_or_create_client_scope(keycloak_admin, {
-        "name": "auth-target-aud",
-        "protocol": "openid-connect",
-        "attributes": {
-            "include.in.token.scope": "true",
-            "display.on.consent.screen": "true"
-        }
-    })
-    add_audience_mapper(keycloak_admin, auth_target_scope_id, "auth-target-aud", "auth-target")
+    # The auth-target client and the two scope + mapper pairs are independent,
+    # so they are created concurrently.
+    log("\n--- Creating auth-target client and client scopes ---")
+    flush_log()
+    auth_target_id, agent_spiffe_scope_id, auth_target_scope_id = await asyncio.gather(
+        run_step(
+            state, realm_id, "client 'auth-target'", AUTH_TARGET_CLIENT,
+            get_or_create_client, keycloak_admin, AUTH_TARGET_CLIENT, clients_index,
+        ),
+        setup_scope(
+            state, realm_id, keycloak_admin, scopes_index,
+            AGENT_SPIFFE_SCOPE, AGENT_SPIFFE_ID,
+        ),
+        setup_scope(
+            state, realm_id, keycloak_admin, scopes_index,
+            AUTH_TARGET_SCOPE, AUTH_TARGET_CLIENT["clientId"],
+        ),
+    )
     
     # Assign scopes
-    print("\n--- Assigning scopes ---")
-    
-    # Add agent-spiffe-aud as realm default scope
-    # This ensures all clients (including auto-registered Agent) get tokens with
-    # the Agent's SPIFFE ID in the audience, allowing AuthProxy to exchange them
-    try:
-        keycloak_admin.add_default_default_client_scope(agent_spiffe_scope_id)
-        print("Added 'agent-spiffe-aud' as realm default scope (all clients will get it).")
-    except Exception as e:
-        print(f"Note: Could not add 'agent-spiffe-aud' as realm default (might already exist): {e}")
+    log("\n--- Assigning scopes ---")
+    flush_log()
     
-    # Add auth-target-aud as realm OPTIONAL scope (not default!)
-    # - OPTIONAL means: available to clients for explicit requests, but NOT auto-included in tokens
-    # - This allows token exchange to request this scope without polluting the first token
-    try:
-        keycloak_admin.add_default_optional_client_scope(auth_target_scope_id)
-        print("Added 'auth-target-aud' as realm OPTIONAL scope (available for token exchange, not auto-included).")
-    except Exception as e:
-        print(f"Note: Could not add 'auth-target-aud' as optional scope (might already exist): {e}")
+    # The assignments are independent, so they run concurrently; messages are
+    # printed after both finish to keep the output order stable.
+    assignments = [
+        # Add agent-spiffe-aud as realm default scope
+        # This ensures all clients (including auto-registered Agent) get tokens with
+        # the Agent's SPIFFE ID in the audience, allowing AuthProxy to exchange them
+        (
+            "realm default scope 'agent-spiffe-aud'",
+            keycloak_admin.a_add_default_default_client_scope,
+            agent_spiffe_scope_id,
+            "Added 'agent-spiffe-aud' as realm default scope (all clients will get it).",
+            "Note: Could not add 'agent-spiffe-aud' as realm default (might already exist)",
+        ),
+        # Add auth-target-aud as realm OPTIONAL scope (not default!)
+        # - OPTIONAL means: available to clients for explicit requests, but NOT auto-included in tokens
+        # - This allows token exchange to request this scope without polluting the first token
+        (
+            "realm optional scope 'auth-target-aud'",
+            keycloak_admin.a_add_default_optional_client_scope,
+            auth_target_scope_id,
+            "Added 'auth-target-aud' as realm OPTIONAL scope (available for token exchange, not auto-included).",
+            "Note: Could not add 'auth-target-aud' as optional scope (might already exist)",
+        ),
+    ]
+    pending = []
+    for description, *assignment in assignments:
+        add_scope, scope_id = assignment[:2]
+        key = step_key(realm_id, add_scope.__name__, {"scope_id": scope_id})
+        if key in state:
+            log(f"Skipping {description} (already done)")
+        else:
+            pending.append((key, assignment))
+    if pending:
+        results = await asyncio.gather(
+            *(assign_scope(*assignment) for _, assignment in pending)
+        )
+        for (key, _), (added, message) in zip(pending, results):
+            log(message)
+            if added:
+                state[key] = True
+        save_state(state)
     
     # Create demo user for demonstrating subject preservation
-    print("\n--- Creating demo user ---")
-    print("This user demonstrates how the subject (sub) claim is preserved during token exchange")
-    get_or_create_user(keycloak_admin, DEMO_USER)
-    
-    # Retrieve and display info
-    print("\n" + "=" * 60)
-    print("SETUP COMPLETE")
-    print("=" * 60)
-    
-    print("\n" + "=" * 60)
-    print("NEXT STEPS")
-    print("=" * 60)
-    
-    print("\n1. Deploy the AuthBridge demo:")
-    print("\n   # With SPIFFE (requires SPIRE)")
-    print("   kubectl apply -f demos/single-target/k8s/authbridge-deployment.yaml")
-    print("\n   # OR without SPIFFE")
-    print("   kubectl apply -f demos/single-target/k8s/authbridge-deployment-no-spiffe.yaml\n")
-    
-    print("2. Wait for pods to be ready:")
-    print("\n   kubectl wait --for=condition=available --timeout=120s deployment/agent -n authbridge")
-    print("   kubectl wait --for=condition=available --timeout=120s deployment/auth-target -n authbridge\n")
-    
-    print("3. Test from inside the agent pod:")
-    print(f"""
-   kubectl exec -it deployment/agent -n authbridge -c agent -- sh
-   
-   # Inside the container (credentials are auto-populated by client-registration):
-   CLIENT_ID=$(cat /shared/client-id.txt)
-   CLIENT_SECRET=$(cat /shared/client-secret.txt)
-   
-   # Get a token (simulating what a Caller would do)
-   # The token will have aud: {AGENT_SPIFFE_ID}
-   TOKEN=$(curl -sX POST \\
-     http://keycloak-service.keycloak.svc:8080/realms/demo/protocol/openid-connect/token \\
-     -d 'grant_type=client_credentials' \\
-     -d "client_id=$CLIENT_ID" \\
-     -d "client_secret=$CLIENT_SECRET" | jq -r '.access_token')
-   
-   # Verify token audience (should be the Agent's SPIFFE ID)
-   echo $TOKEN | cut -d'.' -f2 | tr '_-' '/+' | {{ read p; echo "${{p}}=="; }} | base64 -d | jq '{{aud, azp, scope}}'
-   
-   # Agent calls auth-target (AuthProxy will exchange token for aud: auth-target)
-   curl -H "Authorization: Bearer $TOKEN" http://auth-target-service:8081/test
-   # Expected: "authorized"
-""")
-    
-    print("4. Test with a USER TOKEN (demonstrates subject preservation):")
-    print(f"""
-   # Get a token for demo user 'alice' using password grant
-   # This demonstrates how the user's identity (sub claim) is preserved during exchange
-   
-   USER_TOKEN=$(curl -sX POST \\
-     http://keycloak-service.keycloak.svc:8080/realms/demo/protocol/openid-connect/token \\
-     -d 'grant_type=password' \\
-     -d "client_id=$CLIENT_ID" \\
-     -d "client_secret=$CLIENT_SECRET" \\
-     -d 'username={DEMO_USER["username"]}' \\
-     -d 'password={DEMO_USER["password"]}' | jq -r '.access_token')
-   
-   # Check the ORIGINAL token - note the 'sub' claim contains alice's user ID
-   # and 'preferred_username' shows 'alice'
-   echo "=== ORIGINAL TOKEN (user: alice) ==="
-   echo $USER_TOKEN | cut -d'.' -f2 | tr '_-' '/+' | {{ read p; echo "${{p}}=="; }} | base64 -d | jq '{{sub, preferred_username, aud, azp}}'
-   
-   # Call auth-target - token exchange preserves the subject!
-   curl -H "Authorization: Bearer $USER_TOKEN" http://auth-target-service:8081/test
-   # Expected: "authorized"
-   
-   # Check auth-target logs to see alice's subject in the exchanged token:
-   kubectl logs deployment/auth-target -n authbridge | grep -A5 "JWT Debug" | tail -10
-""")
+    log("\n--- Creating demo user ---")
+    log("This user demonstrates how the subject (sub) claim is preserved during token exchange")
+    flush_log()
+    await run_step(
+        state, realm_id, f"user '{DEMO_USER['username']}'", DEMO_USER,
+        get_or_create_user, keycloak_admin, DEMO_USER,
+    )
     
-    print("\n" + "-" * 60)
-    print("HOW IT WORKS")
-    print("-" * 60)
-    print(f"""
-1. Agent pod starts and registers with Keycloak using its SPIFFE ID:
-   client_id = {AGENT_SPIFFE_ID}
+    log(NEXT_STEPS_TEMPLATE.format(
+        agent_spiffe_id=AGENT_SPIFFE_ID,
+        username=DEMO_USER["username"],
+        password=DEMO_USER["password"],
+    ))
 
-2. Credentials are saved to /shared/client-id.txt and /shared/client-secret.txt
-
-3. When a Caller gets a token, it has:
-   aud: {AGENT_SPIFFE_ID}  (via agent-spiffe-aud realm default scope)
 
-4. AuthProxy intercepts outgoing requests and exchanges the token using
-   the same credentials from /shared/ (matching the token's audience)
-
-5. The exchanged token has aud: auth-target
-
-No pre-configured 'agent' client needed - the agent registers itself
-dynamically and AuthProxy uses the resulting client credentials!
-""")
+async def main():
+    async with admin_http_client() as http_client:
+        await configure_keycloak(http_client)
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        asyncio.run(main())
+    finally:
+        flush_log()
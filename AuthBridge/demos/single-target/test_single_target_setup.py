@@ -0,0 +1,111 @@
+"""Unit tests for the single-target setup's retry transport and step keys.
+
+Run from this directory with: python -m unittest test_single_target_setup
+"""
+
+import importlib.util
+import os
+import unittest
+from unittest import mock
+
+import httpx
+
+_spec = importlib.util.spec_from_file_location(
+    "single_target_setup",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "setup_keycloak.py"),
+)
+setup = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(setup)
+
+URL = "http://keycloak:8080/admin/realms/demo/clients"
+
+
+class RetryTransportTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.transport = setup.RetryTransport()
+
+    async def send(self, method, *outcomes):
+        """Send one request through RetryTransport; the wrapped transport
+        answers each attempt with the next outcome (a status or an exception).
+        Returns the final response (or raised exception) and the attempt count."""
+        outcomes = list(outcomes)
+
+        async def handle(request):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return httpx.Response(outcome, request=request)
+
+        with mock.patch.object(httpx.AsyncHTTPTransport, "handle_async_request",
+                               side_effect=handle) as inner, \
+                mock.patch.object(setup.asyncio, "sleep", new=mock.AsyncMock()):
+            request = httpx.Request(method, URL)
+            try:
+                result = await self.transport.handle_async_request(request)
+            except httpx.HTTPError as e:
+                result = e
+        return result, inner.call_count
+
+    async def test_idempotent_methods_are_retried_on_gateway_errors(self):
+        for method in setup.IDEMPOTENT_METHODS:
+            for status in setup.RETRY_STATUSES:
+                response, attempts = await self.send(method, status, 200)
+                self.assertEqual((response.status_code, attempts), (200, 2))
+
+    async def test_post_is_not_retried_on_gateway_errors(self):
+        response, attempts = await self.send("POST", 503, 201)
+        self.assertEqual((response.status_code, attempts), (503, 1))
+
+    async def test_other_statuses_are_not_retried(self):
+        response, attempts = await self.send("GET", 500, 200)
+        self.assertEqual((response.status_code, attempts), (500, 1))
+
+    async def test_connect_errors_are_retried_for_every_method(self):
+        for method in ("GET", "POST"):
+            response, attempts = await self.send(
+                method, httpx.ConnectError("refused"), httpx.ConnectTimeout("timed out"), 201
+            )
+            self.assertEqual((response.status_code, attempts), (201, 3))
+
+    async def test_read_errors_are_not_retried(self):
+        error, attempts = await self.send("POST", httpx.ReadTimeout("timed out"), 201)
+        self.assertIsInstance(error, httpx.ReadTimeout)
+        self.assertEqual(attempts, 1)
+
+    async def test_gives_up_after_the_last_attempt(self):
+        response, attempts = await self.send("GET", *[503] * setup.RETRY_ATTEMPTS)
+        self.assertEqual((response.status_code, attempts), (503, setup.RETRY_ATTEMPTS))
+
+        error, attempts = await self.send(
+            "POST", *[httpx.ConnectError("refused")] * setup.RETRY_ATTEMPTS
+        )
+        self.assertIsInstance(error, httpx.ConnectError)
+        self.assertEqual(attempts, setup.RETRY_ATTEMPTS)
+
+
+class StepKeyTest(unittest.TestCase):
+    PAYLOAD = {"clientId": "auth-target", "attributes": {"a": "1", "b": "2"}}
+
+    def test_is_deterministic(self):
+        key = setup.step_key("realm-uuid", "a_create_client", self.PAYLOAD)
+        self.assertEqual(key, setup.step_key("realm-uuid", "a_create_client", self.PAYLOAD))
+        self.assertRegex(key, r"^[0-9a-f]{64}$")
+
+    def test_ignores_payload_key_order(self):
+        reordered = {"attributes": {"b": "2", "a": "1"}, "clientId": "auth-target"}
+        self.assertEqual(
+            setup.step_key("realm-uuid", "a_create_client", self.PAYLOAD),
+            setup.step_key("realm-uuid", "a_create_client", reordered),
+        )
+
+    def test_changes_with_realm_operation_and_payload(self):
+        key = setup.step_key("realm-uuid", "a_create_client", self.PAYLOAD)
+        self.assertNotEqual(key, setup.step_key("other-realm", "a_create_client", self.PAYLOAD))
+        self.assertNotEqual(key, setup.step_key("realm-uuid", "a_create_client_scope", self.PAYLOAD))
+        self.assertNotEqual(
+            key, setup.step_key("realm-uuid", "a_create_client", {**self.PAYLOAD, "clientId": "x"})
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
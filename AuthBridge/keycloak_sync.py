@@ -9,24 +9,43 @@ Keycloak remains the source of truth - this script only proposes changes.
 """
 
 import argparse
+import io
 import sys
 import yaml
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional
 
-from keycloak import KeycloakAdmin
+from keycloak import KeycloakAdmin, KeycloakGetError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+# Prefer libyaml's C loader when PyYAML was built with it.
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 
-@dataclass
+# Accepted answers to confirmation prompts
+_YES = frozenset(("y", "yes"))
+
+
+@dataclass(slots=True)
 class RouteTarget:
     """A target from routes.yaml that needs reconciliation."""
     host: str
     audience: str
     scopes: list[str]
     passthrough: bool = False
+    # Distinct scopes ending in -aud, in the order they appear in token_scopes.
+    audience_scopes: tuple[str, ...] = field(init=False)
 
+    def __post_init__(self):
+        self.audience_scopes = tuple(
+            dict.fromkeys(s for s in self.scopes if s.endswith("-aud"))
+        )
 
-@dataclass
+
+@dataclass(slots=True)
 class ReconcileResult:
     """Summary of reconciliation actions."""
     targets_checked: int = 0
@@ -41,10 +60,31 @@ class ReconcileResult:
     errors: int = 0
 
 
+class OfflineKeycloakAdmin:
+    """Stand-in for KeycloakAdmin that reads an empty realm without network I/O.
+
+    Used by --offline-dry-run; the reconciler never writes in dry-run mode, so
+    only the read methods it calls are provided.
+    """
+
+    def get_clients(self) -> list[dict]:
+        return []
+
+    def get_client(self, _client_id: str) -> dict:
+        return {}
+
+    def get_client_scopes(self) -> list[dict]:
+        return []
+
+    def get_client_optional_client_scopes(self, _client_id: str) -> list[dict]:
+        return []
+
+
 class KeycloakReconciler:
     """Reconciles routes.yaml targets with Keycloak configuration."""
 
     HOSTNAME_ATTRIBUTE = "authbridge.hostname"
+    AUDIENCE_MAPPER = "oidc-audience-mapper"
 
     def __init__(self, keycloak_admin: KeycloakAdmin, dry_run: bool = False,
                  auto_yes: bool = False, agent_client: Optional[str] = None):
@@ -52,39 +92,68 @@ class KeycloakReconciler:
         self.dry_run = dry_run
         self.auto_yes = auto_yes
         self.agent_client = agent_client
+        # Output is buffered per target and written to stdout in one go
+        self._out = io.StringIO()
         self.agent_client_uuid: Optional[str] = None
         self.result = ReconcileResult()
 
+        # Fetch all clients once; existence checks are answered from this index
+        # instead of one get_client_id round-trip per target, and the listed
+        # representations (including attributes) serve the hostname checks.
+        self._clients = {c["id"]: c for c in self.kc.get_clients()}
+        self._client_index = {c["clientId"]: c["id"] for c in self._clients.values()}
+        # Client scopes by name, listed on first use.
+        self._scope_index: Optional[dict[str, dict]] = None
+
         # Look up agent client UUID if provided
         if agent_client:
-            self.agent_client_uuid = self.kc.get_client_id(agent_client)
+            self.agent_client_uuid = self._client_index.get(agent_client)
             if not self.agent_client_uuid:
-                print(f"[MISSING] Agent client '{agent_client}' not found in Keycloak")
+                self._log(f"[MISSING] Agent client '{agent_client}' not found in Keycloak")
                 if self._prompt(f"  Create agent client '{agent_client}'?"):
                     self.agent_client_uuid = self._create_agent_client(agent_client)
                     if self.agent_client_uuid:
+                        self._client_index[agent_client] = self.agent_client_uuid
                         self.result.agent_client_created = True
                     else:
                         self.result.errors += 1
                 else:
-                    print("  --> Skipped")
+                    self._log("  --> Skipped")
+            self._flush()
+
+        # Optional scopes already assigned to the agent, fetched once per run.
+        self._agent_optional_scope_names: set[str] = set()
+        if self.agent_client_uuid:
+            try:
+                self._agent_optional_scope_names = {
+                    s.get("name") for s in
+                    self.kc.get_client_optional_client_scopes(self.agent_client_uuid)
+                }
+            except Exception:
+                # If we cannot retrieve existing optional scopes, assignments are
+                # attempted anyway; the add call will handle conflicts.
+                pass
 
     def reconcile(self, targets: list[RouteTarget]) -> ReconcileResult:
         """Reconcile all targets against Keycloak."""
         for target in targets:
             if target.passthrough:
-                print(f"\n[{target.audience}]")
-                print("  - Passthrough route, skipping")
+                self._log(f"\n[{target.audience}]")
+                self._log("  - Passthrough route, skipping")
+                self._flush()
                 continue
 
-            self._reconcile_target(target)
+            try:
+                self._reconcile_target(target)
+            finally:
+                self._flush()
             self.result.targets_checked += 1
 
         return self.result
 
     def _reconcile_target(self, target: RouteTarget):
         """Reconcile a single target."""
-        print(f"\n[{target.audience}]")
+        self._log(f"\n[{target.audience}]")
 
         # Step 1: Check client exists
         client_id = self._check_client(target.audience)
@@ -92,67 +161,67 @@ class KeycloakReconciler:
             return
 
         # Step 2: Check scopes
-        self._check_scopes(target.audience, target.scopes, client_id)
+        if target.audience_scopes:
+            self._check_scopes(target.audience, target.audience_scopes, client_id)
 
         # Step 3: Check hostname attribute
         self._check_hostname(target.audience, target.host, client_id)
 
     def _check_client(self, audience: str) -> Optional[str]:
         """Check if client exists in Keycloak. Returns client UUID or None."""
-        client_id = self.kc.get_client_id(audience)
+        client_id = self._client_index.get(audience)
 
         if client_id:
-            print(f"  [OK] Client exists")
+            self._log(f"  [OK] Client exists")
             return client_id
 
-        print(f"  [MISSING] Client '{audience}' not found in Keycloak")
+        self._log(f"  [MISSING] Client '{audience}' not found in Keycloak")
         if self._prompt(f"    Create client '{audience}'?"):
             client_id = self._create_client(audience)
             if client_id:
+                self._client_index[audience] = client_id
                 self.result.clients_created += 1
                 return client_id
             else:
                 self.result.errors += 1
                 return None
         else:
-            print("    --> Skipped")
+            self._log("    --> Skipped")
             self.result.clients_skipped += 1
             return None
 
-    def _check_scopes(self, audience: str, scopes: list[str], _client_id: str):
-        """Check that required scopes exist with correct audience mappers."""
-        # Find scopes that look like audience scopes (ending in -aud)
-        audience_scopes = [s for s in scopes if s.endswith("-aud")]
-
+    def _check_scopes(self, audience: str, audience_scopes: tuple[str, ...],
+                      _client_id: str):
+        """Check that the target's audience scopes exist with correct audience mappers."""
         for scope_name in audience_scopes:
             scope = self._find_scope(scope_name)
 
             if scope is None:
-                print(f"  [MISSING] Scope '{scope_name}' not found")
+                self._log(f"  [MISSING] Scope '{scope_name}' not found")
                 if self._prompt(f"    Create scope '{scope_name}' with audience mapper?"):
-                    if self._create_scope_with_mapper(scope_name, audience):
+                    scope_id = self._create_scope_with_mapper(scope_name, audience)
+                    if scope_id:
                         self.result.scopes_created += 1
                         # Assign newly created scope to agent
-                        scope = self._find_scope(scope_name)
-                        if scope and self.agent_client_uuid:
-                            self._assign_scope_to_agent(scope_name, scope["id"])
+                        if self.agent_client_uuid:
+                            self._assign_scope_to_agent(scope_name, scope_id)
                     else:
                         self.result.errors += 1
                 else:
-                    print("    --> Skipped")
+                    self._log("    --> Skipped")
                     self.result.scopes_skipped += 1
                 continue
 
-            print(f"  [OK] Scope '{scope_name}' exists")
+            self._log(f"  [OK] Scope '{scope_name}' exists")
 
             # Check mapper
-            mapper = self._find_audience_mapper(scope["id"])
+            mapper = self._find_audience_mapper(scope)
             if mapper is None:
-                print(f"  [WARN] Scope '{scope_name}' has no audience mapper")
+                self._log(f"  [WARN] Scope '{scope_name}' has no audience mapper")
                 if self._prompt(f"    Add audience mapper for '{audience}'?"):
-                    self._add_audience_mapper(scope["id"], scope_name, audience)
+                    self._add_audience_mapper(scope, audience)
             else:
-                print(f"  [OK] Audience mapper correctly configured")
+                self._log(f"  [OK] Audience mapper correctly configured")
 
             # Assign scope to agent client if specified
             if self.agent_client_uuid:
@@ -160,35 +229,38 @@ class KeycloakReconciler:
 
     def _check_hostname(self, _audience: str, expected_host: str, client_id: str):
         """Check that the client has the correct hostname attribute."""
-        client = self.kc.get_client(client_id)
-        attributes = client.get("attributes", {})
+        client = self._clients.get(client_id)
+        if client is None:
+            # Created during this run, so not part of the initial listing
+            client = self._clients[client_id] = self.kc.get_client(client_id)
+        attributes = client.setdefault("attributes", {})
         current_host = attributes.get(self.HOSTNAME_ATTRIBUTE)
 
         if current_host is None:
-            print(f"  [WARN] No hostname attribute set")
+            self._log(f"  [WARN] No hostname attribute set")
             if self._prompt(f"    Set hostname to '{expected_host}'?"):
-                self._set_hostname_attribute(client_id, expected_host)
+                self._set_hostname_attribute(client_id, attributes, expected_host)
                 self.result.hostnames_set += 1
             else:
-                print("    --> Skipped")
+                self._log("    --> Skipped")
                 self.result.hostnames_skipped += 1
         elif current_host != expected_host:
-            print(f"  [WARN] Hostname is '{current_host}', config says '{expected_host}'")
+            self._log(f"  [WARN] Hostname is '{current_host}', config says '{expected_host}'")
             if self._prompt(f"    Update hostname to '{expected_host}'?"):
-                self._set_hostname_attribute(client_id, expected_host)
+                self._set_hostname_attribute(client_id, attributes, expected_host)
                 self.result.hostnames_set += 1
             else:
-                print("    --> Skipped")
+                self._log("    --> Skipped")
                 self.result.hostnames_skipped += 1
         else:
-            print(f"  [OK] Hostname attribute matches")
+            self._log(f"  [OK] Hostname attribute matches")
 
     # --- Keycloak operations ---
 
     def _create_client(self, client_id: str) -> Optional[str]:
         """Create a new client in Keycloak."""
         if self.dry_run:
-            print(f"    --> [DRY RUN] Would create client '{client_id}'")
+            self._log(f"    --> [DRY RUN] Would create client '{client_id}'")
             return "dry-run-id"
 
         try:
@@ -200,18 +272,18 @@ class KeycloakReconciler:
                 "standardFlowEnabled": False,
                 "serviceAccountsEnabled": False,
             }
-            self.kc.create_client(payload)
-            uuid = self.kc.get_client_id(client_id)
-            print(f"    --> Created client '{client_id}'")
+            # create_client returns the new UUID from the Location header
+            uuid = self.kc.create_client(payload, skip_exists=False)
+            self._log(f"    --> Created client '{client_id}'")
             return uuid
         except Exception as e:
-            print(f"    --> Error creating client: {e}")
+            self._log(f"    --> Error creating client: {e}")
             return None
 
     def _create_agent_client(self, client_id: str) -> Optional[str]:
         """Create an agent client in Keycloak with appropriate settings."""
         if self.dry_run:
-            print(f"  --> [DRY RUN] Would create agent client '{client_id}'")
+            self._log(f"  --> [DRY RUN] Would create agent client '{client_id}'")
             return "dry-run-id"
 
         try:
@@ -228,42 +300,42 @@ class KeycloakReconciler:
                     "standard.token.exchange.enabled": "true",
                 },
             }
-            self.kc.create_client(payload)
-            uuid = self.kc.get_client_id(client_id)
-            print(f"  --> Created agent client '{client_id}'")
+            # create_client returns the new UUID from the Location header
+            uuid = self.kc.create_client(payload, skip_exists=False)
+            self._log(f"  --> Created agent client '{client_id}'")
 
             # Note: Do not print the client secret to stdout to avoid leaking credentials.
             # The secret can be retrieved securely via the Keycloak admin console or API.
 
             return uuid
         except Exception as e:
-            print(f"  --> Error creating agent client: {e}")
+            self._log(f"  --> Error creating agent client: {e}")
             return None
 
     def _find_scope(self, scope_name: str) -> Optional[dict]:
         """Find a client scope by name."""
-        scopes = self.kc.get_client_scopes()
-        for scope in scopes:
-            if scope["name"] == scope_name:
-                return scope
-        return None
+        if self._scope_index is None:
+            self._scope_index = {s["name"]: s for s in self.kc.get_client_scopes()}
+        return self._scope_index.get(scope_name)
 
-    def _find_audience_mapper(self, scope_id: str) -> Optional[dict]:
+    def _find_audience_mapper(self, scope: dict) -> Optional[dict]:
         """Find an audience mapper in a scope."""
-        try:
-            mappers = self.kc.get_mappers_from_client_scope(scope_id)
-            for mapper in mappers:
-                if mapper.get("protocolMapper") == "oidc-audience-mapper":
-                    return mapper
-        except Exception:
-            pass
-        return None
+        # The scope's mappers are indexed by type once and kept on the cached scope
+        mappers_by_type = scope.get("_mappers")
+        if mappers_by_type is None:
+            # Keycloak omits protocolMappers from a listed scope only when it has none
+            mappers = scope.get("protocolMappers", [])
+            # Reversed so the first mapper of each type wins
+            mappers_by_type = scope["_mappers"] = {
+                m.get("protocolMapper"): m for m in reversed(mappers)
+            }
+        return mappers_by_type.get(self.AUDIENCE_MAPPER)
 
-    def _create_scope_with_mapper(self, scope_name: str, audience: str) -> bool:
-        """Create a client scope with an audience mapper."""
+    def _create_scope_with_mapper(self, scope_name: str, audience: str) -> Optional[str]:
+        """Create a client scope with an audience mapper. Returns the scope UUID."""
         if self.dry_run:
-            print(f"    --> [DRY RUN] Would create scope '{scope_name}'")
-            return True
+            self._log(f"    --> [DRY RUN] Would create scope '{scope_name}'")
+            return "dry-run-id"
 
         try:
             scope_payload = {
@@ -274,26 +346,28 @@ class KeycloakReconciler:
                     "display.on.consent.screen": "false",
                 },
             }
-            self.kc.create_client_scope(scope_payload)
-            scope = self._find_scope(scope_name)
-            if scope:
-                self._add_audience_mapper(scope["id"], scope_name, audience)
-                print(f"    --> Created scope '{scope_name}' with audience mapper")
-                return True
+            # The new scope's UUID comes from the Location header of the create call.
+            scope_id = self.kc.create_client_scope(scope_payload)
+            scope = {"id": scope_id, "name": scope_name, "_mappers": {}}
+            if self._scope_index is not None:
+                self._scope_index[scope_name] = scope
+            self._add_audience_mapper(scope, audience)
+            self._log(f"    --> Created scope '{scope_name}' with audience mapper")
+            return scope_id
         except Exception as e:
-            print(f"    --> Error creating scope: {e}")
-        return False
+            self._log(f"    --> Error creating scope: {e}")
+        return None
 
-    def _add_audience_mapper(self, scope_id: str, mapper_name: str, audience: str):
-        """Add an audience mapper to a scope."""
+    def _add_audience_mapper(self, scope: dict, audience: str):
+        """Add an audience mapper, named after the scope, to a scope."""
         if self.dry_run:
-            print(f"    --> [DRY RUN] Would add audience mapper")
+            self._log(f"    --> [DRY RUN] Would add audience mapper")
             return
 
         mapper_payload = {
-            "name": mapper_name,
+            "name": scope["name"],
             "protocol": "openid-connect",
-            "protocolMapper": "oidc-audience-mapper",
+            "protocolMapper": self.AUDIENCE_MAPPER,
             "consentRequired": False,
             "config": {
                 "included.custom.audience": audience,
@@ -303,68 +377,77 @@ class KeycloakReconciler:
             },
         }
         try:
-            self.kc.add_mapper_to_client_scope(scope_id, mapper_payload)
-            print(f"    --> Added audience mapper")
+            self.kc.add_mapper_to_client_scope(scope["id"], mapper_payload)
+            self._log(f"    --> Added audience mapper")
+            # Keep the cached mappers in step for later targets sharing the scope
+            scope.setdefault("_mappers", {})[self.AUDIENCE_MAPPER] = mapper_payload
         except Exception as e:
-            print(f"    --> Error adding mapper: {e}")
+            self._log(f"    --> Error adding mapper: {e}")
 
-    def _set_hostname_attribute(self, client_id: str, hostname: str):
-        """Set the hostname attribute on a client."""
+    def _set_hostname_attribute(self, client_id: str, attributes: dict, hostname: str):
+        """Set the hostname attribute on a client, given its current attributes."""
         if self.dry_run:
-            print(f"    --> [DRY RUN] Would set hostname to '{hostname}'")
+            self._log(f"    --> [DRY RUN] Would set hostname to '{hostname}'")
             return
 
         try:
-            client = self.kc.get_client(client_id)
-            attributes = client.get("attributes", {})
+            self.kc.update_client(
+                client_id, {"attributes": {**attributes, self.HOSTNAME_ATTRIBUTE: hostname}}
+            )
+            # Keep the cached client representation in step with Keycloak
             attributes[self.HOSTNAME_ATTRIBUTE] = hostname
-            self.kc.update_client(client_id, {"attributes": attributes})
-            print(f"    --> Set hostname attribute")
+            self._log(f"    --> Set hostname attribute")
         except Exception as e:
-            print(f"    --> Error setting hostname: {e}")
+            self._log(f"    --> Error setting hostname: {e}")
 
     def _assign_scope_to_agent(self, scope_name: str, scope_id: str):
         """Assign a scope to the agent client as an optional scope."""
         if not self.agent_client_uuid:
             return
 
-        # Check if already assigned
-        try:
-            optional_scopes = self.kc.get_client_optional_client_scopes(self.agent_client_uuid)
-            for s in optional_scopes:
-                if s.get("name") == scope_name:
-                    print(f"  [OK] Scope '{scope_name}' already assigned to agent")
-                    return
-        except Exception:
-            # If we cannot retrieve existing optional scopes, continue and attempt
-            # to assign the scope anyway; the subsequent call will handle conflicts.
-            pass
+        if scope_name in self._agent_optional_scope_names:
+            self._log(f"  [OK] Scope '{scope_name}' already assigned to agent")
+            return
 
         if self.dry_run:
-            print(f"    --> [DRY RUN] Would assign scope '{scope_name}' to agent")
+            self._log(f"    --> [DRY RUN] Would assign scope '{scope_name}' to agent")
             return
 
         try:
             self.kc.add_client_optional_client_scope(self.agent_client_uuid, scope_id, {})
-            print(f"  --> Assigned scope '{scope_name}' to agent")
+            self._log(f"  --> Assigned scope '{scope_name}' to agent")
+            self._agent_optional_scope_names.add(scope_name)
             self.result.scopes_assigned += 1
         except Exception as e:
             if "already exists" in str(e).lower() or "409" in str(e):
-                print(f"  [OK] Scope '{scope_name}' already assigned to agent")
+                self._log(f"  [OK] Scope '{scope_name}' already assigned to agent")
+                self._agent_optional_scope_names.add(scope_name)
             else:
-                print(f"    --> Error assigning scope to agent: {e}")
+                self._log(f"    --> Error assigning scope to agent: {e}")
 
     # --- Helpers ---
 
+    def _log(self, message: str = ""):
+        """Append a line to the current target's output buffer."""
+        self._out.write(message + "\n")
+
+    def _flush(self):
+        """Write buffered output to stdout with a single write."""
+        sys.stdout.write(self._out.getvalue())
+        sys.stdout.flush()
+        self._out = io.StringIO()
+
     def _prompt(self, message: str) -> bool:
         """Prompt user for confirmation. Returns True if yes."""
         if self.auto_yes:
-            print(f"{message} [y/N]: y (auto)")
+            self._log(f"{message} [y/N]: y (auto)")
             return True
 
+        # Show everything logged so far before waiting for input
+        self._flush()
         try:
             response = input(f"{message} [y/N]: ").strip().lower()
-            return response in ("y", "yes")
+            return response in _YES
         except EOFError:
             return False
 
@@ -373,30 +456,56 @@ def _prompt_user(message: str) -> bool:
     """Prompt user for confirmation. Returns True if yes."""
     try:
         response = input(f"{message} [y/N]: ").strip().lower()
-        return response in ("y", "yes")
+        return response in _YES
     except EOFError:
         return False
 
 
+class AdminRetry(Retry):
+    """Retry policy for the admin session.
+
+    Like python-keycloak's own adapter, POSTs are retried on connection errors
+    (e.g. a stale keep-alive socket); gateway error statuses are only retried
+    for idempotent methods, since a POST may already have created its object.
+    """
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method == "POST":
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def configure_session(keycloak_admin: KeycloakAdmin):
+    """Retry connection errors and transient gateway errors on the admin client's session."""
+    adapter = HTTPAdapter(
+        max_retries=AdminRetry(
+            total=3,
+            backoff_factor=0.2,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"POST"},
+        ),
+    )
+    session = keycloak_admin.connection._s
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+
 def load_routes(path: str) -> list[RouteTarget]:
     """Load routes from YAML file and convert to RouteTarget objects."""
     with open(path) as f:
-        routes = yaml.safe_load(f) or []
-
-    targets = []
-    for route in routes:
-        if not route.get("target_audience"):
-            continue  # Skip routes without audience (e.g., passthrough-only)
+        routes = yaml.load(f, Loader=YamlLoader) or []
 
-        scopes = route.get("token_scopes", "").split()
-        targets.append(RouteTarget(
+    # Routes without audience (e.g., passthrough-only) are skipped
+    return [
+        RouteTarget(
             host=route.get("host", ""),
             audience=route["target_audience"],
-            scopes=scopes,
+            scopes=route.get("token_scopes", "").split(),
             passthrough=route.get("passthrough", False),
-        ))
-
-    return targets
+        )
+        for route in routes
+        if route.get("target_audience")
+    ]
 
 
 def print_summary(result: ReconcileResult):
@@ -424,6 +533,66 @@ def print_summary(result: ReconcileResult):
         print(f"  {result.errors} errors encountered")
 
 
+def connect_keycloak(args: argparse.Namespace) -> KeycloakAdmin:
+    """Log in to Keycloak and make sure the target realm exists."""
+    # Connect to Keycloak master realm first to check if target realm exists
+    print(f"Connecting to Keycloak at {args.keycloak_url}...")
+    try:
+        master_kc = KeycloakAdmin(
+            server_url=args.keycloak_url,
+            username=args.admin_user,
+            password=args.admin_password,
+            realm_name="master",
+            user_realm_name="master",
+        )
+        configure_session(master_kc)
+    except Exception as e:
+        print(f"Error connecting to Keycloak: {e}")
+        sys.exit(1)
+
+    # Check if realm exists, prompt to create if not
+    realm_exists = False
+    try:
+        master_kc.get_realm(args.realm)
+        realm_exists = True
+    except KeycloakGetError as e:
+        if e.response_code != 404:
+            # Fall back to listing realms if the targeted lookup is not allowed.
+            try:
+                realms = master_kc.get_realms()
+                realm_exists = any(r.get("realm") == args.realm for r in realms)
+            except Exception as e:
+                print(f"Error checking realms: {e}")
+                sys.exit(1)
+    except Exception as e:
+        print(f"Error checking realms: {e}")
+        sys.exit(1)
+
+    if not realm_exists:
+        print(f"[MISSING] Realm '{args.realm}' not found")
+        if args.yes or _prompt_user(f"  Create realm '{args.realm}'?"):
+            if args.dry_run:
+                print(f"  --> [DRY RUN] Would create realm '{args.realm}'")
+            else:
+                try:
+                    master_kc.create_realm({
+                        "realm": args.realm,
+                        "enabled": True,
+                        "displayName": args.realm,
+                    })
+                    print(f"  --> Created realm '{args.realm}'")
+                except Exception as e:
+                    print(f"  --> Error creating realm: {e}")
+                    sys.exit(1)
+        else:
+            print("  --> Skipped (realm required)")
+            sys.exit(1)
+
+    # Switch to the target realm; the master admin token and session are reused
+    master_kc.change_current_realm(args.realm)
+    return master_kc
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Reconcile routes.yaml with Keycloak configuration"
@@ -458,6 +627,12 @@ def main():
         action="store_true",
         help="Show what would be done without making changes"
     )
+    parser.add_argument(
+        "--offline-dry-run",
+        action="store_true",
+        help="Like --dry-run, but without contacting Keycloak: every object is "
+             "treated as missing"
+    )
     parser.add_argument(
         "--yes", "-y",
         action="store_true",
@@ -484,61 +659,12 @@ def main():
 
     print(f"Found {len(targets)} targets to reconcile")
 
-    # Connect to Keycloak master realm first to check if target realm exists
-    print(f"Connecting to Keycloak at {args.keycloak_url}...")
-    try:
-        master_kc = KeycloakAdmin(
-            server_url=args.keycloak_url,
-            username=args.admin_user,
-            password=args.admin_password,
-            realm_name="master",
-            user_realm_name="master",
-        )
-    except Exception as e:
-        print(f"Error connecting to Keycloak: {e}")
-        sys.exit(1)
-
-    # Check if realm exists, prompt to create if not
-    realm_exists = False
-    try:
-        realms = master_kc.get_realms()
-        realm_exists = any(r.get("realm") == args.realm for r in realms)
-    except Exception as e:
-        print(f"Error checking realms: {e}")
-        sys.exit(1)
-
-    if not realm_exists:
-        print(f"[MISSING] Realm '{args.realm}' not found")
-        if args.yes or _prompt_user(f"  Create realm '{args.realm}'?"):
-            if args.dry_run:
-                print(f"  --> [DRY RUN] Would create realm '{args.realm}'")
-            else:
-                try:
-                    master_kc.create_realm({
-                        "realm": args.realm,
-                        "enabled": True,
-                        "displayName": args.realm,
-                    })
-                    print(f"  --> Created realm '{args.realm}'")
-                except Exception as e:
-                    print(f"  --> Error creating realm: {e}")
-                    sys.exit(1)
-        else:
-            print("  --> Skipped (realm required)")
-            sys.exit(1)
-
-    # Connect to target realm
-    try:
-        kc = KeycloakAdmin(
-            server_url=args.keycloak_url,
-            username=args.admin_user,
-            password=args.admin_password,
-            realm_name=args.realm,
-            user_realm_name="master",
-        )
-    except Exception as e:
-        print(f"Error connecting to realm '{args.realm}': {e}")
-        sys.exit(1)
+    if args.offline_dry_run:
+        print("Offline dry run: Keycloak is not contacted, every object is treated as missing")
+        args.dry_run = True
+        kc = OfflineKeycloakAdmin()
+    else:
+        kc = connect_keycloak(args)
 
     # Reconcile
     if args.dry_run:
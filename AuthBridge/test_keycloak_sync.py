@@ -0,0 +1,58 @@
+"""Unit tests for keycloak_sync's admin session retry policy.
+
+Run from this directory with: python -m unittest test_keycloak_sync
+"""
+
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import keycloak_sync  # noqa: E402
+
+
+def admin_retry():
+    return keycloak_sync.AdminRetry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=keycloak_sync.Retry.DEFAULT_ALLOWED_METHODS | {"POST"},
+    )
+
+
+class AdminRetryTest(unittest.TestCase):
+    def test_post_is_not_retried_on_gateway_errors(self):
+        for status in (502, 503, 504):
+            self.assertFalse(admin_retry().is_retry("POST", status))
+
+    def test_idempotent_methods_are_retried_on_gateway_errors(self):
+        for method in ("GET", "PUT", "DELETE"):
+            self.assertTrue(admin_retry().is_retry(method, 503))
+
+    def test_other_statuses_are_not_retried(self):
+        self.assertFalse(admin_retry().is_retry("GET", 500))
+
+    def test_post_is_retried_on_connection_errors(self):
+        retry = admin_retry().increment(method="POST", error=ConnectTimeoutError())
+        self.assertIsInstance(retry, keycloak_sync.AdminRetry)
+        self.assertEqual(retry.total, 2)
+
+
+class ConfigureSessionTest(unittest.TestCase):
+    def test_mounts_admin_retry_for_both_schemes(self):
+        session = requests.Session()
+        admin = SimpleNamespace(connection=SimpleNamespace(_s=session))
+        keycloak_sync.configure_session(admin)
+        for url in ("http://keycloak:8080/", "https://keycloak:8443/"):
+            retries = session.get_adapter(url).max_retries
+            self.assertIsInstance(retries, keycloak_sync.AdminRetry)
+            self.assertFalse(retries.is_retry("POST", 503))
+
+
+if __name__ == "__main__":
+    unittest.main()